@@ -11,15 +11,30 @@ from __future__ import annotations
 
 import os
 import json
-from dataclasses import dataclass, field
-from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import datetime
+import functools
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Set
 
 import google.generativeai as genai
-from tools import execute_tool
+import fast_json
+from plan_cache import SemanticCache, TemplateCache, normalize_text
+from tools import execute_tool, execute_tool_async
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PLAN_CACHE_DB = "plan_cache.db"
 
 # ---- Shared data models --------------------------------------------------------------------
 
-@dataclass
+@dataclass(slots=True)
 class TaskItem:
     description: str
     status: str = "pending"
@@ -27,24 +42,306 @@ class TaskItem:
     priority: Optional[str] = None
     conflicts: List[str] = field(default_factory=list)
 
-@dataclass
+@dataclass(slots=True)
 class TaskPlan:
     tasks: List[TaskItem]
     encouragement: Optional[str] = None
     conflicts: List[str] = field(default_factory=list)
 
-@dataclass
+@dataclass(slots=True)
 class ToolAction:
     kind: str
     payload: Dict[str, Any]
     description: str
 
-@dataclass
+@dataclass(slots=True)
 class AgentTurn:
     user_facing_message: str
     tasks: List[TaskItem] = field(default_factory=list)
     pending_actions: List[ToolAction] = field(default_factory=list)
     requires_confirmation: bool = True
+    is_final: bool = True  # False for the partial turns yielded while a plan streams in
+    executed_results: Optional[List[Dict[str, Any]]] = None  # set when actions were auto-confirmed
+
+def _plan_from_dict(data: Dict[str, Any]) -> TaskPlan:
+    """Rebuilds a TaskPlan from its dataclasses.asdict() form."""
+    return TaskPlan(
+        tasks=[
+            TaskItem(**{**task, "conflicts": list(task.get("conflicts", []))})
+            for task in data.get("tasks", [])
+        ],
+        encouragement=data.get("encouragement"),
+        conflicts=list(data.get("conflicts", [])),
+    )
+
+# Trivial brain dumps ("buy milk") skip the model: one short imperative clause led by a
+# common task verb, with no question, priority or scheduling words. Anything else
+# (greetings, questions, "call mom urgently") goes to the model.
+_TRIVIAL_MAX_WORDS = 12
+_TASK_VERBS = frozenset({
+    "buy", "call", "email", "text", "message", "pay", "clean", "wash", "book", "pick",
+    "send", "write", "read", "finish", "fix", "return", "cancel", "submit", "order",
+    "mail", "file", "renew", "water", "feed", "walk", "cook", "pack", "print", "reply",
+    "charge", "refill", "vacuum", "tidy", "fold", "sweep", "post", "drop", "grab",
+})
+_PRIORITY_RE = re.compile(r"\b(?:urgent(?:ly)?|asap|important|critical|priority|immediately)\b", re.I)
+_MULTI_TASK_RE = re.compile(r"\band\b|\bthen\b|\balso\b|[,;\n]", re.I)
+_DATE_RE = re.compile(
+    r"\b(?:today|tonight|tomorrow|week|weekend|month|"
+    r"mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun|"
+    r"(?:mon|tues|wednes|thurs|fri|satur|sun)day|"
+    r"jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec|"
+    r"\d{1,2}/\d{1,2}(?:/\d{2,4})?|\d{1,2}(?::\d{2})?\s*(?:am|pm)|\d{1,2}:\d{2}|"
+    r"by|before|after|until|at)\b",
+    re.I,
+)
+
+def _is_trivial(user_text: str) -> bool:
+    """True for a single short task with nothing for the model to schedule or split."""
+    words = user_text.split()
+    return (
+        0 < len(words) < _TRIVIAL_MAX_WORDS
+        and words[0].lower() in _TASK_VERBS
+        and "?" not in user_text
+        and _MULTI_TASK_RE.search(user_text) is None
+        and _DATE_RE.search(user_text) is None
+        and _PRIORITY_RE.search(user_text) is None
+    )
+
+def _embed_text(text: str) -> Sequence[float]:
+    """Embeds a brain dump for the semantic response cache."""
+    return genai.embed_content(model="models/text-embedding-004", content=text)["embedding"]
+
+class _TaskStreamParser:
+    """Incrementally scans a streamed plan JSON and yields each task once it closes.
+
+    Only the objects inside the top-level "tasks" array are decoded early. Chunks are
+    kept in a list and each one is scanned exactly once, so a long stream costs O(n)
+    rather than re-concatenating and re-scanning the whole buffer per chunk.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._key_chars: List[str] = []
+        self._last_key: Optional[str] = None
+        self._in_tasks = False
+        self._task_parts: Optional[List[str]] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._chunks.append(chunk)
+        completed: List[Dict[str, Any]] = []
+        task_start = 0 if self._task_parts is not None else None
+        for i, ch in enumerate(chunk):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_key = "".join(self._key_chars)
+                elif len(self._stack) == 1:
+                    self._key_chars.append(ch)
+            elif ch == '"':
+                self._in_string = True
+                self._key_chars.clear()
+            elif ch in "{[":
+                if ch == "[" and self._stack == ["{"] and self._last_key == "tasks":
+                    self._in_tasks = True
+                elif ch == "{" and self._in_tasks and len(self._stack) == 2:
+                    self._task_parts = []
+                    task_start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                self._stack.pop()
+                if self._in_tasks and len(self._stack) == 2 and self._task_parts is not None:
+                    self._task_parts.append(chunk[task_start:i + 1])
+                    completed.append(fast_json.loads("".join(self._task_parts)))
+                    self._task_parts = None
+                    task_start = None
+                elif self._in_tasks and len(self._stack) == 1:
+                    self._in_tasks = False
+        if self._task_parts is not None:
+            self._task_parts.append(chunk[task_start:])
+        return completed
+
+    def document(self) -> Dict[str, Any]:
+        """Parses the full stream, once, after it has ended."""
+        text = self.text
+        # The last non-whitespace character; the final chunk itself may be blank.
+        if text.rstrip()[-1:] not in ("}", "]"):
+            raise ValueError("Plan stream ended before the JSON document closed")
+        return fast_json.loads(text)
+
+# ---- Prompts -------------------------------------------------------------------------------
+
+# Static instruction block shared by every decomposition call. It must stay free of
+# per-request interpolation so the prompt prefix (and any context cache built on it)
+# is byte-identical across users and turns.
+_SYSTEM_INSTRUCTION = """
+You are an expert Task Decomposer for ADHD assistants.
+GOAL: Break down the user's text into atomic tasks.
+
+OUTPUT SCHEMA (JSON):
+{
+    "reasoning": "Step-by-step analysis string",
+    "tasks": [
+        {
+            "description": "Short task description",
+            "due": "Due date or null",
+            "priority": "high/medium/low"
+        }
+    ],
+    "conflicts": ["List of potential conflicts strings"],
+    "encouragement": "Encouraging message string"
+}
+"""
+
+# Structured-output schema matching _SYSTEM_INSTRUCTION. Built once at import and shared
+# by every call, together with the GenerationConfig objects that carry it.
+_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        "tasks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "description": {"type": "string"},
+                    "due": {"type": "string", "nullable": True},
+                    "priority": {"type": "string", "nullable": True},
+                },
+                "required": ["description", "due", "priority"],
+            },
+        },
+        "conflicts": {"type": "array", "items": {"type": "string"}},
+        "encouragement": {"type": "string"},
+    },
+    # Everything the parser reads is required, so it can index without fallbacks.
+    "required": ["tasks", "conflicts", "encouragement"],
+}
+
+_BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "plan": _RESPONSE_SCHEMA,
+                },
+                "required": ["id", "plan"],
+            },
+        },
+    },
+    "required": ["results"],
+}
+
+_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=_RESPONSE_SCHEMA,
+    temperature=0.2,
+)
+
+_BATCH_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=_BATCH_RESPONSE_SCHEMA,
+    temperature=0.2,
+)
+
+# Per-request tail, sent as two parts of the user turn after the static system
+# instruction: the user's context (stable across that user's turns), then the brain
+# dump. Keeping preferences out of the system instruction keeps the shared prefix
+# identical for all users.
+_CONTEXT_TEMPLATE = """
+--- USER CONTEXT ---
+{user_preferences}
+--------------------
+"""
+
+_BRAIN_DUMP_TEMPLATE = """
+User's Brain Dump:
+"{user_text}"
+"""
+
+_DEFAULT_PREFERENCES = "No specific preferences."
+
+@functools.lru_cache(maxsize=256)
+def _context_part(user_preferences: str) -> str:
+    """Rendered context part; a user's preferences repeat across turns, so it is built once."""
+    return _CONTEXT_TEMPLATE.format_map({"user_preferences": user_preferences})
+
+@functools.lru_cache(maxsize=1)
+def _default_response_cache() -> SemanticCache:
+    """Process-wide plan cache, persisted so plans survive across sessions."""
+    return SemanticCache(_embed_text, db_path=PLAN_CACHE_DB)
+
+@functools.lru_cache(maxsize=8)
+def _get_model(model_name: str) -> genai.GenerativeModel:
+    """Shared model instance per name, so agents created per request reuse it.
+
+    The static instruction block travels as the system instruction, so every call
+    shares a byte-identical prefix and only the short dynamic tail differs.
+    """
+    return genai.GenerativeModel(model_name, system_instruction=_SYSTEM_INSTRUCTION)
+
+# One Gemini context cache per model, shared by every agent in the process, so the
+# instruction prefix is uploaded once rather than once per agent instance. Values are
+# (CachedContent, model bound to it).
+_CONTEXT_CACHES: Dict[str, Any] = {}
+_CONTEXT_CACHE_LOCK = threading.Lock()
+
+def _get_cached_model(model_name: str, ttl: datetime.timedelta) -> genai.GenerativeModel:
+    """Model bound to the shared context cache for `model_name`, (re)created on expiry.
+
+    Raises if the cache can't be created (e.g. the prefix is below the minimum
+    cacheable size); callers fall back to the plain model.
+    """
+    with _CONTEXT_CACHE_LOCK:
+        entry = _CONTEXT_CACHES.get(model_name)
+        if entry is None or entry[0].expire_time <= datetime.datetime.now(datetime.timezone.utc):
+            cached = genai.caching.CachedContent.create(
+                model=f"models/{model_name}",
+                system_instruction=_SYSTEM_INSTRUCTION,
+                ttl=ttl,
+            )
+            entry = (cached, genai.GenerativeModel.from_cached_content(cached))
+            _CONTEXT_CACHES[model_name] = entry
+        return entry[1]
+
+def warmup(model_name: str = "gemini-2.5-flash", background: bool = True) -> Optional[threading.Thread]:
+    """Pays model construction and connection setup before the first real request.
+
+    Call this at app startup. It sends a one-token request through the shared model,
+    on a daemon thread by default so startup isn't blocked.
+    """
+
+    def _ping() -> None:
+        try:
+            _get_model(model_name).generate_content(
+                "ping", generation_config=genai.GenerationConfig(max_output_tokens=1)
+            )
+        except Exception as e:
+            logger.info("Model warmup failed: %s", e)
+
+    if not background:
+        _ping()
+        return None
+
+    thread = threading.Thread(target=_ping, name="gemini-warmup", daemon=True)
+    thread.start()
+    return thread
 
 # ---- Agents --------------------------------------------------------------------------------
 
@@ -52,125 +349,472 @@ class TaskLogicAgent:
     """The engine: decomposes user intent using the Free Tier API."""
 
     # CHANGED: Switched to 'gemini-2.5-flash' which is the current stable free-tier model
-    def __init__(self, model_name: str = "gemini-2.5-flash"): 
-        self.model = genai.GenerativeModel(model_name)
+    def __init__(
+        self,
+        model_name: str = "gemini-2.5-flash",
+        use_context_cache: bool = False,
+        cache_ttl: datetime.timedelta = datetime.timedelta(hours=1),
+        response_cache: Optional[SemanticCache] = None,
+        template_cache: Optional[TemplateCache] = None,
+        plan_cache_enabled: bool = True,
+    ):
+        self.model_name = model_name
+        self.use_context_cache = use_context_cache
+        self.cache_ttl = cache_ttl
+        self.model = _get_model(model_name)
+        # Repeated or near-identical brain dumps are answered from here without a model call.
+        # The default cache opens plan_cache.db, so it is only built when caching is on.
+        if response_cache is None and plan_cache_enabled:
+            response_cache = _default_response_cache()
+        self.response_cache = response_cache
+        # Brain dumps that only differ in dates/times/numbers reuse a cached plan template.
+        self.template_cache = template_cache if template_cache is not None else TemplateCache()
+        self.plan_cache_enabled = plan_cache_enabled
 
     def decompose_brain_dump(
-        self, user_text: str, context: Optional[Dict[str, Any]] = None
+        self,
+        user_text: str,
+        context: Optional[Dict[str, Any]] = None,
+        on_task: Optional[Callable[[TaskItem], None]] = None,
     ) -> TaskPlan:
+        """Breaks a brain dump into a TaskPlan.
+
+        When `on_task` is given the model response is streamed and each task is handed
+        to the callback as soon as its JSON object is complete, before the rest of the
+        plan has been generated.
+        """
         context = context or {}
-        
+
+        if _is_trivial(user_text):
+            plan = self._trivial_plan(user_text)
+        else:
+            plan = self._cached_plan(user_text, context)
+        if plan is None:
+            plan = self._generate_plan(user_text, context, on_task)
+        elif on_task is not None:
+            for task in plan.tasks:
+                on_task(task)
+
+        if context.get("encouragement_override"):
+            plan.encouragement = context.get("encouragement_override")
+            
+        return plan
+
+    def prefetch(self, user_text: str) -> None:
+        """Warms context-independent cache work (the text embedding) ahead of a call."""
+        if self.plan_cache_enabled:
+            self.response_cache.prefetch(user_text)
+
+    def _cached_plan(self, user_text: str, context: Dict[str, Any]) -> Optional[TaskPlan]:
+        if not self.plan_cache_enabled:
+            return None
+        cached = self.response_cache.get(user_text, context)
+        if cached is None:
+            cached = self.template_cache.get(user_text, context)
+        return _plan_from_dict(cached) if cached is not None else None
+
+    def _remember(self, user_text: str, context: Dict[str, Any], plan: TaskPlan) -> None:
+        # Only successful decompositions are worth replaying.
+        if self.plan_cache_enabled and plan.tasks:
+            plan_dict = asdict(plan)
+            self.response_cache.put(user_text, plan_dict, context)
+            self.template_cache.put(user_text, plan_dict, context)
+
+    def _generate_plan(
+        self,
+        user_text: str,
+        context: Dict[str, Any],
+        on_task: Optional[Callable[[TaskItem], None]] = None,
+    ) -> TaskPlan:
         prompt = self._construct_prompt(user_text, context)
         
         try:
             # We request JSON response_mime_type for structured output
-            response = self.model.generate_content(
+            response = self._resolve_model().generate_content(
                 prompt,
-                generation_config=genai.GenerationConfig(
-                    response_mime_type="application/json",
-                    temperature=0.2
-                )
+                generation_config=_GENERATION_CONFIG,
+                stream=on_task is not None,
             )
-            plan = self._parse_model_response(response)
+            if on_task is None:
+                plan = self._parse_model_response(response)
+            else:
+                plan = self._consume_stream(response, on_task)
         except Exception as e:
-            print(f"Error calling model or parsing response: {e}")
-            plan = TaskPlan(
-                tasks=[TaskItem(description=user_text)],
-                conflicts=["I had trouble decomposing that. Could you list them one by one?"]
-            )
+            logger.warning("Error calling model or parsing response: %s", e)
+            return self._fallback_plan(user_text)
 
-        if context.get("encouragement_override"):
-            plan.encouragement = context.get("encouragement_override")
-            
+        self._remember(user_text, context, plan)
         return plan
 
-    def _construct_prompt(self, user_text: str, context: Dict[str, Any]) -> str:
-        user_preferences = context.get("user_preferences", "No specific preferences.")
-        
-        return f"""
-        You are an expert Task Decomposer for ADHD assistants.
-        GOAL: Break down the user's text into atomic tasks.
-
-        OUTPUT SCHEMA (JSON):
-        {{
-            "reasoning": "Step-by-step analysis string",
-            "tasks": [
-                {{
-                    "description": "Short task description", 
-                    "due": "Due date or null", 
-                    "priority": "high/medium/low"
-                }}
-            ],
-            "conflicts": ["List of potential conflicts strings"],
-            "encouragement": "Encouraging message string"
-        }}
+    def _consume_stream(self, response, on_task: Callable[[TaskItem], None]) -> TaskPlan:
+        parser = _TaskStreamParser()
+        for chunk in response:
+            for task_data in parser.feed(chunk.text):
+                on_task(self._task_from_dict(task_data))
+        return self._plan_from_response_dict(parser.document())
+
+    @staticmethod
+    def _trivial_plan(user_text: str) -> TaskPlan:
+        return TaskPlan(tasks=[TaskItem(description=user_text.strip())], encouragement="You got this!")
+
+    @staticmethod
+    def _fallback_plan(user_text: str) -> TaskPlan:
+        return TaskPlan(
+            tasks=[TaskItem(description=user_text)],
+            conflicts=["I had trouble decomposing that. Could you list them one by one?"]
+        )
 
-        --- USER CONTEXT ---
-        {user_preferences}
-        --------------------
+    def _resolve_model(self) -> genai.GenerativeModel:
+        """Returns the model to call, backed by the shared context cache when enabled.
 
-        User's Brain Dump:
-        "{user_text}"
+        The cache holds the static instruction block, so each call only sends the
+        dynamic tail (preferences + brain dump). If the cache can't be created we
+        fall back to the plain model for the rest of this agent's life.
         """
+        if not self.use_context_cache:
+            return self.model
+        try:
+            return _get_cached_model(self.model_name, self.cache_ttl)
+        except Exception as e:
+            logger.info("Context cache unavailable, using uncached prompt: %s", e)
+            self.use_context_cache = False
+            return self.model
+
+    def _construct_prompt(self, user_text: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        # One user turn with two parts: context first, then the brain dump.
+        return {
+            "role": "user",
+            "parts": [
+                _context_part(context.get("user_preferences", _DEFAULT_PREFERENCES)),
+                _BRAIN_DUMP_TEMPLATE.format_map({"user_text": user_text}),
+            ],
+        }
 
     @staticmethod
     def _parse_model_response(response) -> TaskPlan:
         try:
-            response_text = response.text
-            response_dict = json.loads(response_text)
+            return TaskLogicAgent._plan_from_response_dict(fast_json.loads(response.text))
         except Exception:
             return TaskPlan(tasks=[], conflicts=["Model response error"])
-            
-        tasks = [TaskItem(**task_data) for task_data in response_dict.get("tasks", [])]
+
+    @staticmethod
+    def _task_from_dict(task_data: Dict[str, Any]) -> TaskItem:
+        # The response schema guarantees these keys; extra keys are dropped because
+        # slotted TaskItems reject them.
+        return TaskItem(
+            description=task_data["description"],
+            due=task_data["due"],
+            priority=task_data["priority"],
+        )
+
+    @staticmethod
+    def _plan_from_response_dict(response_dict: Dict[str, Any]) -> TaskPlan:
+        task_from_dict = TaskLogicAgent._task_from_dict
         return TaskPlan(
-            tasks=tasks,
-            conflicts=response_dict.get("conflicts", []),
-            encouragement=response_dict.get("encouragement", "You got this!"),
+            tasks=[task_from_dict(task_data) for task_data in response_dict["tasks"]],
+            conflicts=response_dict["conflicts"],
+            encouragement=response_dict["encouragement"],
+        )
+
+
+class BatchedTaskLogicAgent:
+    """Coalesces concurrent brain dumps into a single row-marshaled Gemini call.
+
+    Requests arriving within `max_wait` seconds (or until `max_batch` are queued) share
+    one round trip: the model receives a JSON array of rows and answers with one plan
+    per row id. This amortizes per-request overhead and keeps multi-user traffic under
+    the free tier's requests-per-minute limit.
+
+    With `row_marshal=False` a batch is instead sent as parallel single-dump calls
+    (generate_content_async under asyncio.gather): more requests, but each keeps the
+    normal prompt and one bad row can't spoil the others.
+
+    `requests_per_minute` is enforced with a token bucket holding up to
+    min(max_batch, requests_per_minute) calls, so a parallel batch goes out at once
+    and only sustained traffic is slowed to the limit.
+    """
+
+    def __init__(
+        self,
+        task_agent: TaskLogicAgent,
+        max_batch: int = 8,
+        max_wait: float = 0.05,
+        requests_per_minute: Optional[int] = 10,
+        row_marshal: bool = True,
+    ) -> None:
+        self.task_agent = task_agent
+        self.row_marshal = row_marshal
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.rate = requests_per_minute / 60.0 if requests_per_minute else 0.0  # calls per second
+        self.burst = min(max_batch, requests_per_minute) if requests_per_minute else 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._collecting: List[tuple] = []
+        self._rate_lock: Optional[asyncio.Lock] = None
+        self._tokens = float(self.burst)
+        self._last_refill = 0.0
+
+    async def decompose_brain_dump_async(
+        self, user_text: str, context: Optional[Dict[str, Any]] = None
+    ) -> TaskPlan:
+        context = context or {}
+
+        if _is_trivial(user_text):
+            plan = self.task_agent._trivial_plan(user_text)
+        else:
+            # Cache lookups may embed the text (a blocking network call), so keep them
+            # off the event loop.
+            plan = await asyncio.to_thread(self.task_agent._cached_plan, user_text, context)
+        if plan is None:
+            self._ensure_worker()
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((user_text, context, future))
+            plan = await future
+
+        if context.get("encouragement_override"):
+            plan.encouragement = context.get("encouragement_override")
+
+        return plan
+
+    async def close(self) -> None:
+        """Stops the background batcher once queued work has been dispatched."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+            # Requests the batcher had picked up or not yet read still need an answer.
+            pending, self._collecting = self._collecting, []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            for start in range(0, len(pending), self.max_batch):
+                self._start_dispatch(pending[start:start + self.max_batch])
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._rate_lock = asyncio.Lock()
+            self._worker = asyncio.create_task(self._collect_batches())
+
+    async def _collect_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # Kept on the instance so close() can dispatch a half-collected batch.
+            self._collecting = batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self._collecting = []
+            self._start_dispatch(batch)
+
+    def _start_dispatch(self, batch: List[tuple]) -> None:
+        task = asyncio.create_task(self._dispatch(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[tuple]) -> None:
+        try:
+            plans = await self._generate_batch([(text, ctx) for text, ctx, _ in batch])
+        except Exception as e:
+            logger.warning("Error calling model for batch of %d: %s", len(batch), e)
+            plans = [None] * len(batch)
+
+        fresh = [(text, ctx, plan) for (text, ctx, _), plan in zip(batch, plans) if plan is not None]
+        if fresh:
+            # Storing embeds each row and may rebuild from SQLite; do it in a worker thread.
+            await asyncio.to_thread(self._remember_all, fresh)
+
+        for (user_text, context, future), plan in zip(batch, plans):
+            if plan is None:
+                plan = self.task_agent._fallback_plan(user_text)
+            if not future.done():
+                future.set_result(plan)
+
+    def _remember_all(self, rows: List[tuple]) -> None:
+        for user_text, context, plan in rows:
+            self.task_agent._remember(user_text, context, plan)
+
+    async def _generate_batch(self, rows: List[tuple]) -> List[Optional[TaskPlan]]:
+        if len(rows) > 1 and not self.row_marshal:
+            results = await asyncio.gather(
+                *(self._generate_batch([row]) for row in rows), return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.warning("Error calling model for one batched request: %s", result)
+            return [None if isinstance(result, Exception) else result[0] for result in results]
+
+        if len(rows) == 1:
+            user_text, context = rows[0]
+            prompt = self.task_agent._construct_prompt(user_text, context)
+        else:
+            prompt = self._construct_batch_prompt(rows)
+
+        await self._throttle()
+        response = await self.task_agent._resolve_model().generate_content_async(
+            prompt,
+            generation_config=_GENERATION_CONFIG if len(rows) == 1 else _BATCH_GENERATION_CONFIG,
+        )
+
+        if len(rows) == 1:
+            plan = self.task_agent._parse_model_response(response)
+            return [plan if plan.tasks else None]
+
+        plans: List[Optional[TaskPlan]] = [None] * len(rows)
+        for result in fast_json.loads(response.text)["results"]:
+            # The schema fixes the shape, but ids are still the model's to get right.
+            row_id = result["id"]
+            if 0 <= row_id < len(rows):
+                plans[row_id] = TaskLogicAgent._plan_from_response_dict(result["plan"])
+        return plans
+
+    @staticmethod
+    def _construct_batch_prompt(rows: List[tuple]) -> str:
+        marshaled = json.dumps(
+            [
+                {
+                    "id": idx,
+                    "text": user_text,
+                    "prefs": context.get("user_preferences", _DEFAULT_PREFERENCES),
+                }
+                for idx, (user_text, context) in enumerate(rows)
+            ],
+            indent=2,
         )
+        return f"""
+        You will receive several independent brain dumps, one per row.
+        Decompose each row on its own, using only that row's "prefs" as user context.
+
+        Respond with JSON: {{"results": [{{"id": <row id>, "plan": <OUTPUT SCHEMA object>}}]}}
+
+        ROWS:
+        {marshaled}
+        """
+
+    async def _throttle(self) -> None:
+        """Takes one token from the rate-limit bucket, waiting for a refill if it's empty."""
+        if not self.rate:
+            return
+        async with self._rate_lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1.0
+                self._last_refill = loop.time()
+            self._tokens -= 1
 
 
 class ToolExecutionAgent:
     """The hands: schedules tasks, sets reminders."""
 
+    def __init__(self, max_concurrency: int = 16) -> None:
+        # Bounds parallel tool calls so downstream calendar/reminder backends aren't flooded.
+        self.max_concurrency = max_concurrency
+
     def propose_actions(self, tasks: List[TaskItem]) -> List[ToolAction]:
-        actions: List[ToolAction] = []
-        for task in tasks:
-            if task.due:
-                actions.append(
-                    ToolAction(
-                        kind="schedule_event",
-                        payload={"task_description": task.description, "due_date": task.due, "priority": task.priority or 'normal'},
-                        description=f"✅ Schedule '{task.description}' for {task.due}",
-                    )
-                )
-            else:
-                actions.append(
-                    ToolAction(
-                        kind="set_reminder",
-                        payload={"task_description": task.description, "remind_at": '1 hour from now'},
-                        description=f"🔔 Set reminder for '{task.description}'",
-                    )
-                )
-        return actions
+        # One pass in task order, with ToolAction bound locally to skip the global lookup.
+        action = ToolAction
+        return [
+            action(
+                kind="schedule_event",
+                payload={"task_description": task.description, "due_date": task.due, "priority": task.priority or 'normal'},
+                description=f"✅ Schedule '{task.description}' for {task.due}",
+            )
+            if task.due
+            else action(
+                kind="set_reminder",
+                payload={"task_description": task.description, "remind_at": '1 hour from now'},
+                description=f"🔔 Set reminder for '{task.description}'",
+            )
+            for task in tasks
+        ]
 
-    def execute_actions(self, actions: List[ToolAction]) -> List[Any]:
-        results: List[Any] = []
+    @staticmethod
+    def dedupe_actions(actions: List[ToolAction]) -> List[ToolAction]:
+        """Drops repeated actions (same tool, task and due date), keeping the first."""
+        seen: Set[tuple] = set()
+        unique: List[ToolAction] = []
         for action in actions:
-            try:
-                result = execute_tool(action.kind, action.payload)
-                results.append(result)
-            except Exception as e:
-                print(f"Error executing action '{action.kind}': {e}")
-                results.append({"status": "error", "details": str(e)})
-        return results
+            key = (
+                action.kind,
+                normalize_text(action.payload.get("task_description", "")),
+                action.payload.get("due_date"),
+            )
+            if key not in seen:
+                seen.add(key)
+                unique.append(action)
+
+        skipped = len(actions) - len(unique)
+        if skipped:
+            logger.info("Skipped %d duplicate action(s).", skipped)
+        return unique
+
+    def execute_actions(self, actions: List[ToolAction]) -> List[Any]:
+        """Executes independent actions concurrently; results keep the input order.
+
+        Uses a thread pool rather than asyncio.run, so it also works when called from
+        inside a running event loop (e.g. a notebook).
+        """
+        if len(actions) <= 1:
+            return [self._execute_one(action) for action in actions]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(actions))) as pool:
+            return list(pool.map(self._execute_one, actions))
+
+    @staticmethod
+    def _execute_one(action: ToolAction) -> Any:
+        try:
+            return execute_tool(action.kind, action.payload)
+        except Exception as e:
+            logger.warning("Error executing action '%s': %s", action.kind, e)
+            return {"status": "error", "details": str(e)}
+
+    async def execute_actions_async(self, actions: List[ToolAction]) -> List[Any]:
+        """Executes independent actions concurrently; results keep the input order."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _run(action: ToolAction) -> Any:
+            async with semaphore:
+                try:
+                    return await execute_tool_async(action.kind, action.payload)
+                except Exception as e:
+                    logger.warning("Error executing action '%s': %s", action.kind, e)
+                    return {"status": "error", "details": str(e)}
+
+        return list(await asyncio.gather(*(_run(action) for action in actions)))
 
 
 class ConversationManagerAgent:
     """The face/orchestrator."""
 
-    def __init__(self, task_agent: TaskLogicAgent, tool_agent: ToolExecutionAgent) -> None:
+    def __init__(
+        self,
+        task_agent: TaskLogicAgent,
+        tool_agent: ToolExecutionAgent,
+        context_ttl: float = 60.0,
+    ) -> None:
         self.task_agent = task_agent
         self.tool_agent = tool_agent
+        # Per-user context from get_user_context, reused across turns for context_ttl seconds.
+        self.context_ttl = context_ttl
+        self._ctx_cache: Dict[str, tuple] = {}
 
     def handle_user_message(
         self,
@@ -179,38 +823,156 @@ class ConversationManagerAgent:
         auto_confirm: bool = False,
     ) -> AgentTurn:
         
-        context_action = ToolAction(
-            kind="get_user_context",
-            payload={"user_id": user_id},
-            description="Fetching user context.",
+        context = self._cached_context(user_id)
+        if context is None:
+            context_result = self.tool_agent.execute_actions([self._context_action(user_id)])
+            context = self._store_context(user_id, context_result[0])
+
+        # Propose actions for each task while the rest of the plan is still streaming in.
+        streamed_tasks: List[TaskItem] = []
+        pending_actions: List[ToolAction] = []
+
+        def _on_task(task: TaskItem) -> None:
+            streamed_tasks.append(task)
+            pending_actions.extend(self.tool_agent.propose_actions([task]))
+
+        plan = self.task_agent.decompose_brain_dump(
+            user_text=user_text, context=context, on_task=_on_task
         )
-        context_result = self.tool_agent.execute_actions([context_action])
-        context = context_result[0].get("context", {})
+        # A failed stream falls back to a different plan; re-propose for what we return.
+        if streamed_tasks != plan.tasks:
+            pending_actions = self.tool_agent.propose_actions(plan.tasks)
+        pending_actions = self.tool_agent.dedupe_actions(pending_actions)
 
-        plan = self.task_agent.decompose_brain_dump(user_text=user_text, context=context)
+        requires_confirmation = not auto_confirm
+
+        turn = self._compose_turn(plan, pending_actions, requires_confirmation)
+        if auto_confirm:
+            turn.executed_results = self.tool_agent.execute_actions(pending_actions)
+        return turn
+
+    async def handle_user_message_async(
+        self,
+        user_text: str,
+        user_id: str = "default_user",
+        auto_confirm: bool = False,
+    ) -> AgentTurn:
+        """Async variant of handle_user_message.
+
+        The context fetch doesn't depend on the brain dump, so it runs concurrently
+        with the context-free half of the work: embedding the text for the semantic
+        cache. For a returning user whose cached context has expired, decomposition
+        starts right away on the previous context while it is re-fetched; the plan is
+        only redone if the refreshed context turns out to differ.
+        """
+        stale = self._ctx_cache.get(user_id)
+        if self._cached_context(user_id) is None and stale is not None:
+            context, plan = await asyncio.gather(
+                self._fetch_context_async(user_id),
+                asyncio.to_thread(self.task_agent.decompose_brain_dump, user_text, stale[1]),
+            )
+            if context != stale[1]:
+                plan = await asyncio.to_thread(self.task_agent.decompose_brain_dump, user_text, context)
+        else:
+            context, _ = await asyncio.gather(
+                self._fetch_context_async(user_id),
+                asyncio.to_thread(self.task_agent.prefetch, user_text),
+            )
+            plan = await asyncio.to_thread(self.task_agent.decompose_brain_dump, user_text, context)
 
-        pending_actions = self.tool_agent.propose_actions(plan.tasks)
+        pending_actions = self.tool_agent.dedupe_actions(self.tool_agent.propose_actions(plan.tasks))
         requires_confirmation = not auto_confirm
 
+        turn = self._compose_turn(plan, pending_actions, requires_confirmation)
         if auto_confirm:
-            self.tool_agent.execute_actions(pending_actions)
+            turn.executed_results = await self.tool_agent.execute_actions_async(pending_actions)
+        return turn
+
+    async def stream_user_message(
+        self,
+        user_text: str,
+        user_id: str = "default_user",
+        auto_confirm: bool = False,
+    ) -> AsyncIterator[AgentTurn]:
+        """Yields a partial AgentTurn as each task streams in, then the final turn.
+
+        Partial turns (is_final=False) list the tasks decomposed so far and carry no
+        actions; the last turn matches what handle_user_message_async returns.
+        """
+        context = await self._fetch_context_async(user_id)
 
-        message_parts: List[str] = []
-        if plan.encouragement:
-            message_parts.append(plan.encouragement)
+        loop = asyncio.get_running_loop()
+        arrivals: asyncio.Queue = asyncio.Queue()
+
+        def _on_task(task: TaskItem) -> None:
+            loop.call_soon_threadsafe(arrivals.put_nowait, task)
+
+        decomposition = asyncio.ensure_future(
+            asyncio.to_thread(self.task_agent.decompose_brain_dump, user_text, context, _on_task)
+        )
+        # Queued behind every task the worker thread has already handed over.
+        decomposition.add_done_callback(lambda _: arrivals.put_nowait(None))
+
+        streamed: List[TaskItem] = []
+        while (task := await arrivals.get()) is not None:
+            streamed.append(task)
+            partial = self._compose_turn(TaskPlan(tasks=list(streamed)), [], requires_confirmation=False)
+            yield replace(partial, is_final=False)
+
+        plan = await decomposition
+        pending_actions = self.tool_agent.dedupe_actions(self.tool_agent.propose_actions(plan.tasks))
+        requires_confirmation = not auto_confirm
+
+        turn = self._compose_turn(plan, pending_actions, requires_confirmation)
+        if auto_confirm:
+            turn.executed_results = await self.tool_agent.execute_actions_async(pending_actions)
+        yield turn
+
+    def _cached_context(self, user_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._ctx_cache.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.context_ttl:
+            return entry[1]
+        return None
+
+    def _store_context(self, user_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        context = result.get("context", {})
+        # Only successful fetches are cached; a failed one is retried next turn.
+        if result.get("status") == "success":
+            self._ctx_cache[user_id] = (time.monotonic(), context)
+        return context
+
+    async def _fetch_context_async(self, user_id: str) -> Dict[str, Any]:
+        context = self._cached_context(user_id)
+        if context is None:
+            context_result = await self.tool_agent.execute_actions_async([self._context_action(user_id)])
+            context = self._store_context(user_id, context_result[0])
+        return context
+
+    @staticmethod
+    def _context_action(user_id: str) -> ToolAction:
+        return ToolAction(
+            kind="get_user_context",
+            payload={"user_id": user_id},
+            description="Fetching user context.",
+        )
+
+    @staticmethod
+    def _compose_turn(
+        plan: TaskPlan, pending_actions: List[ToolAction], requires_confirmation: bool
+    ) -> AgentTurn:
+        # Each section is built as one list and added with a single extend.
+        message_parts: List[str] = [plan.encouragement] if plan.encouragement else []
 
         if plan.tasks:
             message_parts.append("\nHere's what I've broken down for you:")
-            for idx, task in enumerate(plan.tasks, start=1):
-                task_details = [f"{idx}. {task.description}"]
-                if task.due:
-                    task_details.append(f" (Due: {task.due})")
-                message_parts.append("".join(task_details))
-        
+            message_parts.extend([
+                f"{idx}. {task.description} (Due: {task.due})" if task.due else f"{idx}. {task.description}"
+                for idx, task in enumerate(plan.tasks, start=1)
+            ])
+
         if pending_actions and requires_confirmation:
             message_parts.append("\nI'll set these up for you:")
-            for action in pending_actions:
-                message_parts.append(f"- {action.description}")
+            message_parts.extend([f"- {action.description}" for action in pending_actions])
             message_parts.append("\nSound good?")
         elif not plan.tasks:
             message_parts.append("I couldn't find any specific tasks to list. Could you rephrase?")
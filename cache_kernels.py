@@ -0,0 +1,44 @@
+"""
+cache_kernels.py - Numeric kernels for the plan caches
+Compiled with Numba when it is installed (pip install numba); otherwise the same
+functions run on plain NumPy.
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+def _cosine_scores(query: np.ndarray, bank: np.ndarray, norms: np.ndarray) -> np.ndarray:
+    """Cosine similarity of a unit `query` to every row of `bank`, given the row norms.
+
+    `bank` may be int8-quantized: a per-row scale cancels out of the cosine, so the
+    raw codes and their norms are all that's needed. Rows are scored independently,
+    so under Numba the outer loop runs in parallel.
+    """
+    n = bank.shape[0]
+    scores = np.empty(n, dtype=np.float32)
+    for i in prange(n):
+        total = 0.0
+        for j in range(bank.shape[1]):
+            total += bank[i, j] * query[j]
+        scores[i] = total / (norms[i] + 1e-9)
+    return scores
+
+
+def _cosine_scores_numpy(query: np.ndarray, bank: np.ndarray, norms: np.ndarray) -> np.ndarray:
+    return (bank.astype(np.float32) @ query) / (norms + 1e-9)
+
+
+if njit is not None:
+    # cache=True writes the compiled kernel next to this file, so only the first
+    # process ever pays the compile; the warm-up call below loads it at import time
+    # instead of on the first user request.
+    cosine_scores = njit(parallel=True, fastmath=True, cache=True)(_cosine_scores)
+    cosine_scores(np.ones(2, dtype=np.float32), np.ones((1, 2), dtype=np.int8), np.ones(1, dtype=np.float32))
+else:
+    cosine_scores = _cosine_scores_numpy
+
@@ -3,97 +3,179 @@ evaluation.py - LLM-as-a-Judge for ADHD Assistant
 Evaluates the 'Effectiveness' and 'Robustness' of the agent's planning.
 """
 import os
-import json
+import datetime
+import functools
+import threading
+from dataclasses import asdict
+
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+import fast_json
+
 # Import your actual agent architecture
-from agents import TaskLogicAgent, ToolExecutionAgent, ConversationManagerAgent
+from agents import TaskLogicAgent, ToolExecutionAgent, ConversationManagerAgent, warmup
 
 # 1. Setup Environment
-load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("❌ GOOGLE_API_KEY not found in .env!")
-genai.configure(api_key=api_key)
-
-# 2. Define the "Golden" Test Case
-TEST_CASE = {
-    "name": "Decomposition Stress Test",
-    "input_text": (
-        "I need to apply for a visa by Friday, buy groceries for dinner tonight, "
-        "and also email my boss about the project delay."
-    ),
-    "expected_behavior": "The agent should split this into 3 distinct tasks with different due dates/priorities."
+@functools.lru_cache(maxsize=1)
+def _ensure_configured() -> None:
+    """Loads the API key and configures genai once, on first use rather than at import."""
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("❌ GOOGLE_API_KEY not found in .env!")
+    genai.configure(api_key=api_key)
+
+# 2. Define the "Golden" Test Cases
+TEST_CASES = [
+    {
+        "name": "Decomposition Stress Test",
+        "input_text": (
+            "I need to apply for a visa by Friday, buy groceries for dinner tonight, "
+            "and also email my boss about the project delay."
+        ),
+        "expected_behavior": "The agent should split this into 3 distinct tasks with different due dates/priorities."
+    },
+]
+
+# All cases are graded in one judge call that returns one verdict per case, in order.
+_VERDICTS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "score": {"type": "INTEGER"},
+            "reasoning": {"type": "STRING"},
+            "pass": {"type": "BOOLEAN"},
+        },
+        "required": ["score", "reasoning", "pass"],
+    },
 }
 
-def run_evaluation():
-    print(f"🧪 STARTING EVALUATION: {TEST_CASE['name']}")
+# The rubric is identical for every run, so it travels as the judge's system instruction
+# (optionally backed by a Gemini context cache); each call only sends the cases.
+_JUDGE_RUBRIC = """
+You are an expert AI Evaluator. Your job is to grade an AI Assistant's performance.
+
+### THE TASK
+The Assistant receives a messy "brain dump" from a user with ADHD.
+It must decompose this into atomic, clear, and actionable sub-tasks.
+
+### EVALUATION CRITERIA
+1. **Atomicity**: Are the tasks split correctly? (e.g. "Buy groceries" and "Email boss" should be separate).
+2. **Temporal Awareness**: Did it catch the due dates? ("Friday", "Tonight").
+3. **Hallucination**: Did it invent tasks that weren't asked for?
+
+### YOUR VERDICT
+Return a JSON array with exactly one verdict per case, in case order. Each verdict has:
+- "score": An integer from 1-10 (10 is perfect).
+- "reasoning": A brief explanation of why you gave this score.
+- "pass": Boolean (True if score >= 7).
+"""
+
+# Judge models per (model_name, use_context_cache). Cached entries also keep their
+# CachedContent so an expired rubric cache can be detected and re-created.
+_JUDGE_MODELS = {}
+_JUDGE_MODELS_LOCK = threading.Lock()
+
+def _get_judge_model(model_name: str = "gemini-2.5-flash", use_context_cache: bool = False) -> genai.GenerativeModel:
+    """Shared judge model, built once per process instead of once per run.
+
+    With `use_context_cache` the rubric is uploaded once as a CachedContent and
+    re-uploaded once it expires; if that fails (e.g. the rubric is below the minimum
+    cacheable size) the plain model is used.
+    """
+    with _JUDGE_MODELS_LOCK:
+        key = (model_name, use_context_cache)
+        cached, model = _JUDGE_MODELS.get(key, (None, None))
+        if model is not None and (
+            cached is None or cached.expire_time > datetime.datetime.now(datetime.timezone.utc)
+        ):
+            return model
+
+        cached = None
+        if use_context_cache:
+            try:
+                cached = genai.caching.CachedContent.create(
+                    model=f"models/{model_name}",
+                    system_instruction=_JUDGE_RUBRIC,
+                    ttl=datetime.timedelta(hours=1),
+                )
+                model = genai.GenerativeModel.from_cached_content(cached)
+            except Exception as e:
+                print(f"⚠️ Judge context cache unavailable, using uncached rubric: {e}")
+                cached = None
+        if cached is None:
+            model = genai.GenerativeModel(model_name, system_instruction=_JUDGE_RUBRIC)
+        _JUDGE_MODELS[key] = (cached, model)
+        return model
+
+def _build_judge_prompt(cases, plans) -> str:
+    return "\n".join(
+        f"""
+### CASE {i}: {case['name']}
+User said: "{case['input_text']}"
+Expected: {case['expected_behavior']}
+Agent's output plan:
+{plan}
+"""
+        for i, (case, plan) in enumerate(zip(cases, plans), start=1)
+    )
+
+def run_evaluation(test_cases=TEST_CASES, use_context_cache=False):
+    _ensure_configured()
+    print(f"🧪 STARTING EVALUATION: {len(test_cases)} case(s)")
     print("-" * 60)
 
     # --- A. Run the Agent (The "Subject") ---
     print("🤖 1. Running Agent...")
     
     # CHANGED: Use the working model ID 'gemini-2.5-flash'
-    task_agent = TaskLogicAgent(model_name="gemini-2.5-flash") 
+    # Plan cache off: a cached plan would grade an earlier run, not the current model.
+    task_agent = TaskLogicAgent(model_name="gemini-2.5-flash", plan_cache_enabled=False)
+    warmup(task_agent.model_name)
     tool_agent = ToolExecutionAgent()
     manager = ConversationManagerAgent(task_agent, tool_agent)
 
-    # Execute the logic (auto_confirm=False to inspect the plan)
-    turn = manager.handle_user_message(TEST_CASE["input_text"], user_id="eval_user", auto_confirm=False)
-    
-    # Extract the "Actual" output to judge
-    # We only care about the tasks list for this evaluation
-    actual_plan_str = json.dumps([t.__dict__ for t in turn.tasks], indent=2)
-    print(f"   -> Agent generated {len(turn.tasks)} tasks.")
+    actual_plans = []
+    for case in test_cases:
+        # Execute the logic (auto_confirm=False to inspect the plan)
+        turn = manager.handle_user_message(case["input_text"], user_id="eval_user", auto_confirm=False)
+
+        # Extract the "Actual" output to judge
+        # We only care about the tasks list for this evaluation
+        actual_plans.append(fast_json.dumps([asdict(t) for t in turn.tasks], indent=True))
+        print(f"   -> {case['name']}: agent generated {len(turn.tasks)} tasks.")
 
     # --- B. Run the Judge (The "Critic") ---
     print("⚖️  2. Running Judge (LLM-as-a-Judge)...")
     
     # Use 'gemini-2.5-flash' for the judge as well to ensure it runs
-    judge_model = genai.GenerativeModel("gemini-2.5-flash") 
-    
-    judge_prompt = f"""
-    You are an expert AI Evaluator. Your job is to grade an AI Assistant's performance.
-    
-    ### THE TASK
-    The Assistant receives a messy "brain dump" from a user with ADHD.
-    It must decompose this into atomic, clear, and actionable sub-tasks.
-    
-    ### THE INPUT
-    User said: "{TEST_CASE['input_text']}"
-    
-    ### THE AGENT'S OUTPUT PLAN
-    {actual_plan_str}
-    
-    ### EVALUATION CRITERIA
-    1. **Atomicity**: Are the tasks split correctly? (e.g. "Buy groceries" and "Email boss" should be separate).
-    2. **Temporal Awareness**: Did it catch the due dates? ("Friday", "Tonight").
-    3. **Hallucination**: Did it invent tasks that weren't asked for?
-    
-    ### YOUR VERDICT
-    Provide a JSON response with:
-    - "score": An integer from 1-10 (10 is perfect).
-    - "reasoning": A brief explanation of why you gave this score.
-    - "pass": Boolean (True if score >= 7).
-    """
+    judge_model = _get_judge_model("gemini-2.5-flash", use_context_cache)
     
-    # Get the verdict
+    # Get every verdict in one call
     response = judge_model.generate_content(
-        judge_prompt,
-        generation_config=genai.GenerationConfig(response_mime_type="application/json")
+        _build_judge_prompt(test_cases, actual_plans),
+        generation_config=genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=_VERDICTS_SCHEMA,
+        )
     )
     
     try:
-        verdict = json.loads(response.text)
-        print("\n" + "="*30)
-        print(f"🏆 FINAL SCORE: {verdict['score']}/10")
-        print(f"✅ PASSED: {verdict['pass']}")
-        print(f"📝 REASONING: {verdict['reasoning']}")
-        print("="*30)
+        verdicts = fast_json.loads(response.text)
+        for case, verdict in zip(test_cases, verdicts):
+            print("\n" + "="*30)
+            print(f"📋 CASE: {case['name']}")
+            print(f"🏆 FINAL SCORE: {verdict['score']}/10")
+            print(f"✅ PASSED: {verdict['pass']}")
+            print(f"📝 REASONING: {verdict['reasoning']}")
+            print("="*30)
+        if len(verdicts) != len(test_cases):
+            print(f"⚠️ Judge returned {len(verdicts)} verdicts for {len(test_cases)} cases.")
     except Exception as e:
         print(f"❌ Error parsing judge response: {e}")
         print(response.text)
 
 if __name__ == "__main__":
-    run_evaluation()
\ No newline at end of file
+    run_evaluation()
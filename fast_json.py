@@ -0,0 +1,52 @@
+"""
+fast_json.py - JSON helpers shared by the agents, tools, caches and evaluation
+Uses orjson when it is installed (pip install orjson); otherwise the stdlib json module.
+Both raise json.JSONDecodeError (orjson's error subclasses it).
+"""
+import json
+import mmap
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+
+    def dumps_line(obj: Any) -> bytes:
+        """One compact JSON Lines record, newline included."""
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    def load_file(f, size: int) -> Any:
+        """Parses an open binary file straight from a read-only memory map, with no bytes copy."""
+        if size == 0:
+            return orjson.loads(b"")  # raises JSONDecodeError; mmap can't map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                return orjson.loads(view)
+            finally:
+                view.release()  # the map can't close while a view is exported
+else:
+    loads = json.loads
+
+    def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+        return json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        """One compact JSON Lines record, newline included."""
+        return (json.dumps(obj) + "\n").encode("utf-8")
+
+    def load_file(f, size: int) -> Any:
+        """Parses an open binary file."""
+        return json.loads(f.read())
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    return dumps_bytes(obj, indent).decode("utf-8")
@@ -0,0 +1,462 @@
+"""
+plan_cache.py - Response caches for the TaskLogicAgent
+Lets repeated (or near-identical) brain dumps skip the Gemini round trip.
+"""
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import fast_json
+from cache_kernels import cosine_scores
+
+# A plan is stored in its serialized form (dataclasses.asdict) so hits hand out fresh copies.
+PlanDict = Dict[str, Any]
+EmbedFn = Callable[[str], Sequence[float]]
+
+logger = logging.getLogger(__name__)
+
+_WEEKDAYS = r"(?:mon|tues|wednes|thurs|fri|satur|sun)day"
+_MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*"
+
+# Entities masked out of a brain dump before template matching: dates, times and numbers.
+_ENTITY_RE = re.compile(
+    r"\b(?:"
+    r"today|tonight|tomorrow|"
+    rf"(?:next|this)\s+(?:week|weekend|month|{_WEEKDAYS})|"
+    rf"{_WEEKDAYS}|{_MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?|"
+    r"\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}(?:/\d{2,4})?|"
+    r"\d{1,2}(?::\d{2})?\s*(?:am|pm)|\d{1,2}:\d{2}|\d+"
+    r")\b",
+    re.IGNORECASE,
+)
+_SLOT_RE = re.compile(r"<ENTITY(\d+)>")
+
+
+def normalize_text(text: str) -> str:
+    """Lower-cases and collapses whitespace so trivial edits still share a key."""
+    return " ".join(text.lower().split())
+
+
+def mask_entities(text: str) -> Tuple[str, List[str]]:
+    """Replaces dates/times/numbers with <ENTITYn> slots.
+
+    Returns the normalized pattern and the entities in slot order, e.g.
+    "Mail rent Friday" -> ("mail rent <ENTITY1>", ["Friday"]).
+    """
+    entities: List[str] = []
+
+    def _slot(match: "re.Match[str]") -> str:
+        entities.append(match.group(0))
+        return f"<ENTITY{len(entities)}>"
+
+    masked = _ENTITY_RE.sub(_slot, text)
+    # Normalize around the slots so their casing survives.
+    return " ".join(masked.split()).lower().replace("<entity", "<ENTITY"), entities
+
+
+def context_fingerprint(context: Optional[Dict[str, Any]]) -> str:
+    """Hashes the parts of the user context that influence the generated plan."""
+    subset = {"user_preferences": (context or {}).get("user_preferences")}
+    return hashlib.sha256(json.dumps(subset, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _CacheEntry:
+    scope: tuple
+    plan: PlanDict
+    row: Optional[int]  # row in SemanticCache._bank, None without an embedding
+    hits: int = 0
+
+
+class SemanticCache:
+    """Two-tier (exact + embedding similarity) cache of decomposed plans.
+
+    Tier 1 is a dict keyed by sha256(normalized text + context fingerprint).
+    Tier 2 compares the cosine similarity of the text embedding against stored entries
+    that share the same context fingerprint and the same dates/times/numbers (embeddings
+    barely separate "Friday" from "Monday").
+
+    The in-memory (hot) set is capped at `max_size` entries and evicts the least
+    frequently used one, oldest first among ties. Plans that are near-duplicates
+    (cosine >= `dedup_threshold`) of a hot entry are not added a second time, so the
+    hot set stays diverse.
+
+    Embeddings live in one preallocated (max_size, dim) int8 matrix, each row
+    quantized with its own scale (max |v| / 127), plus parallel vectors of the
+    quantized rows' norms and scope ids. A lookup is a single contiguous scoring pass
+    over the whole matrix at a quarter of the bytes of float32 (see
+    cache_kernels.cosine_scores), with other scopes and free rows masked out. SQLite keeps float16
+    copies, so a rebuild re-quantizes from the more precise values.
+
+    With `db_path`, plans and their hit counts also go to a SQLite table (the global
+    set) from a background writer thread. Plans with a due date the model resolved
+    itself (not a literal date/time from the input) are not persisted: it would be
+    wrong in a later week. The hot set is rebuilt from it on start-up
+    and every `rebuild_every` stores: most-hit plans first, skipping near-duplicates.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Optional[EmbedFn] = None,
+        threshold: float = 0.92,
+        max_size: int = 256,
+        db_path: Optional[str] = None,
+        dedup_threshold: float = 0.95,
+        rebuild_every: int = 100,
+    ) -> None:
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_size = max_size
+        self.dedup_threshold = dedup_threshold
+        self.rebuild_every = rebuild_every
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bank: Optional[np.ndarray] = None  # allocated once the embedding size is known
+        self._norms: Optional[np.ndarray] = None  # L2 norm of each quantized bank row
+        self._row_scopes: Optional[np.ndarray] = None  # scope id of each bank row, -1 if free
+        self._row_keys: List[Optional[str]] = []
+        self._scope_ids: Dict[tuple, int] = {}
+        self._free_rows: List[int] = []
+        self._last_embedding: Optional[tuple] = None
+        self._stores_since_rebuild = 0
+        # Guards the hot set (entries, bank, free rows). Re-entrant because put() can
+        # trigger a rebuild().
+        self._lock = threading.RLock()
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        # Agents may call in from worker threads (asyncio.to_thread), so share one
+        # connection behind a lock.
+        self._db_lock = threading.Lock()
+        if db_path is not None:
+            self._open_db(db_path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(user_text: str, context: Optional[Dict[str, Any]] = None) -> str:
+        raw = normalize_text(user_text) + context_fingerprint(context)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, user_text: str, context: Optional[Dict[str, Any]] = None) -> Optional[PlanDict]:
+        """Returns a cached plan for this brain dump, or None on a miss."""
+        key = self.make_key(user_text, context)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            # Embed outside the lock: it may be a network round trip.
+            query = self._embed(user_text)
+            if query is None:
+                return None
+            scope = self._scope(user_text, context)
+            with self._lock:
+                key, score = self._nearest(query, scope)
+                if key is None or score < self.threshold:
+                    return None
+                entry = self._entries[key]
+
+        with self._lock:
+            entry.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        self._record_hit(key)
+        return entry.plan
+
+    def put(self, user_text: str, plan: PlanDict, context: Optional[Dict[str, Any]] = None) -> None:
+        """Stores a plan in the global set and, unless it duplicates one, the hot set."""
+        key = self.make_key(user_text, context)
+        scope = self._scope(user_text, context)
+        vec = self._embed(user_text)
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                existing.plan = plan
+                self._entries.move_to_end(key)
+            elif vec is not None and self._nearest(vec, scope)[1] >= self.dedup_threshold:
+                pass  # a near-identical plan is already hot
+            else:
+                while len(self._entries) >= self.max_size:
+                    self._evict()
+                self._entries[key] = _CacheEntry(scope, plan, self._store(key, vec, scope))
+
+            # Dates the model resolved ("Friday" -> "2023-10-26") go stale, so such
+            # plans stay in this process's hot set but are never persisted.
+            if not _has_derived_due(_make_slots(plan, mask_entities(user_text)[1])):
+                self._persist(key, scope, plan, vec)
+
+    def prefetch(self, user_text: str) -> None:
+        """Computes the embedding for user_text now so the next get() reuses it."""
+        self._embed(user_text)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset_hot_set()
+        self._last_embedding = None
+        if self._db is not None:
+            self._wait_for_writes()
+            with self._db_lock, self._db:
+                self._db.execute("DELETE FROM plan_cache")
+
+    def rebuild(self) -> None:
+        """Refills the hot set from the global table: top plans by hits, deduplicated."""
+        if self._db is None:
+            return
+        self._wait_for_writes()
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT key, scope, goal_embedding, plan_json, hits FROM plan_cache "
+                "ORDER BY hits DESC, last_used DESC"
+            ).fetchall()
+
+        with self._lock:
+            self._reset_hot_set()
+            selected = []
+            for key, scope_json, blob, plan_json, hits in rows:
+                if len(selected) >= self.max_size:
+                    break
+                scope = tuple(fast_json.loads(scope_json))
+                scope = (scope[0], tuple(scope[1]))
+                vec = np.frombuffer(blob, dtype=np.float16).astype(np.float32) if blob else None
+                if vec is not None and self._nearest(vec, scope)[1] >= self.dedup_threshold:
+                    continue
+                entry = _CacheEntry(scope, fast_json.loads(plan_json), self._store(key, vec, scope), hits)
+                self._entries[key] = entry
+                selected.append(key)
+
+            # Least frequently used first, matching the order eviction scans in.
+            for key in sorted(selected, key=lambda k: self._entries[k].hits):
+                self._entries.move_to_end(key)
+            self._stores_since_rebuild = 0
+
+    def _nearest(self, query: np.ndarray, scope: tuple) -> Tuple[Optional[str], float]:
+        """Best same-scope hot entry for a unit query vector, as (key, cosine)."""
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None or self._bank is None or query.shape[0] != self._bank.shape[1]:
+            return None, -1.0
+
+        scores = cosine_scores(query, self._bank, self._norms)
+        scores[self._row_scopes != scope_id] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] == -np.inf:
+            return None, -1.0
+        return self._row_keys[best], float(scores[best])
+
+    def _evict(self) -> None:
+        # min() keeps the first minimum, i.e. the least recently used among the least hit.
+        victim = min(self._entries, key=lambda k: self._entries[k].hits)
+        entry = self._entries.pop(victim)
+        if entry.row is not None:
+            self._row_scopes[entry.row] = -1
+            self._row_keys[entry.row] = None
+            self._free_rows.append(entry.row)
+
+    def _reset_hot_set(self) -> None:
+        self._entries.clear()
+        self._bank = None
+        self._norms = None
+        self._row_scopes = None
+        self._row_keys = []
+        self._scope_ids = {}
+        self._free_rows = []
+
+    def _open_db(self, db_path: str) -> None:
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plan-cache-db")
+        with self._db_lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS plan_cache ("
+                "key TEXT PRIMARY KEY, scope TEXT, goal_embedding BLOB, plan_json TEXT, "
+                "hits INTEGER DEFAULT 0, last_used REAL)"
+            )
+        self.rebuild()
+
+    def _write(self, sql: str, params: tuple) -> None:
+        with self._db_lock, self._db:
+            self._db.execute(sql, params)
+
+    def _wait_for_writes(self) -> None:
+        # The writer is a single thread, so a no-op queued now finishes after every earlier write.
+        self._writer.submit(lambda: None).result()
+
+    def _persist(self, key: str, scope: tuple, plan: PlanDict, vec: Optional[np.ndarray]) -> None:
+        if self._db is None:
+            return
+        blob = vec.astype(np.float16).tobytes() if vec is not None else None
+        self._writer.submit(
+            self._write,
+            "INSERT INTO plan_cache (key, scope, goal_embedding, plan_json, hits, last_used) "
+            "VALUES (?, ?, ?, ?, 0, ?) "
+            "ON CONFLICT(key) DO UPDATE SET goal_embedding = excluded.goal_embedding, "
+            "plan_json = excluded.plan_json, last_used = excluded.last_used",
+            (key, fast_json.dumps(scope), blob, fast_json.dumps(plan), time.time()),
+        )
+        self._stores_since_rebuild += 1
+        if self._stores_since_rebuild >= self.rebuild_every:
+            self.rebuild()
+
+    def _record_hit(self, key: str) -> None:
+        if self._db is None:
+            return
+        self._writer.submit(
+            self._write,
+            "UPDATE plan_cache SET hits = hits + 1, last_used = ? WHERE key = ?",
+            (time.time(), key),
+        )
+
+    def _store(self, key: str, vec: Optional[np.ndarray], scope: tuple) -> Optional[int]:
+        """Quantizes a unit embedding into a free bank row and returns the row index."""
+        if vec is None:
+            return None
+        if self._bank is None:
+            self._bank = np.empty((self.max_size, vec.shape[0]), dtype=np.int8)
+            self._norms = np.ones(self.max_size, dtype=np.float32)
+            self._row_scopes = np.full(self.max_size, -1, dtype=np.int32)
+            self._row_keys = [None] * self.max_size
+            self._free_rows = list(range(self.max_size - 1, -1, -1))
+        if vec.shape[0] != self._bank.shape[1] or not self._free_rows:
+            return None
+
+        row = self._free_rows.pop()
+        # Symmetric per-row int8 quantization. The scale itself isn't kept: it cancels
+        # out of the cosine, which only needs the codes and their norm.
+        scale = float(np.abs(vec).max()) / 127 or 1.0
+        codes = np.round(vec / scale).astype(np.int8)
+        self._bank[row] = codes
+        self._norms[row] = np.linalg.norm(codes.astype(np.float32))
+        self._row_scopes[row] = self._scope_ids.setdefault(scope, len(self._scope_ids))
+        self._row_keys[row] = key
+        return row
+
+    @staticmethod
+    def _scope(user_text: str, context: Optional[Dict[str, Any]]) -> tuple:
+        """Entries are only semantically comparable within the same scope."""
+        _, entities = mask_entities(user_text)
+        return context_fingerprint(context), tuple(e.lower() for e in entities)
+
+    def _embed(self, user_text: str) -> Optional[np.ndarray]:
+        """Embeds and L2-normalizes text. A failed embedding simply disables tier 2."""
+        if self.embed_fn is None:
+            return None
+
+        # get() followed by put() embeds the same text twice; remember the last one.
+        text = normalize_text(user_text)
+        last = self._last_embedding  # read once: another thread may replace it
+        if last is not None and last[0] == text:
+            return last[1]
+
+        try:
+            vec = np.asarray(self.embed_fn(text), dtype=np.float32)
+        except Exception as e:
+            logger.warning("Embedding failed, skipping semantic lookup: %s", e)
+            return None
+
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return None
+        vec = vec / norm
+        self._last_embedding = (text, vec)
+        return vec
+
+
+class TemplateCache:
+    """Caches plan templates for brain dumps that differ only in dates/times/numbers.
+
+    "Mail the rent check Friday" and "Mail the rent check Monday" mask to the same
+    pattern, so the second is answered by filling the first plan's slots locally.
+    """
+
+    def __init__(self, max_size: int = 256) -> None:
+        self.max_size = max_size
+        self._templates: "OrderedDict[str, PlanDict]" = OrderedDict()
+        # Called from worker threads like SemanticCache, so guard the LRU order.
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def get(self, user_text: str, context: Optional[Dict[str, Any]] = None) -> Optional[PlanDict]:
+        """Returns the cached plan with this text's entities filled in, or None."""
+        pattern, entities = mask_entities(user_text)
+        if not entities:
+            return None
+
+        key = pattern + context_fingerprint(context)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                return None
+            self._templates.move_to_end(key)
+        return _fill_slots(template, entities)
+
+    def put(self, user_text: str, plan: PlanDict, context: Optional[Dict[str, Any]] = None) -> None:
+        """Derives a template from a fresh plan; plans that can't be templated are skipped."""
+        pattern, entities = mask_entities(user_text)
+        if not entities:
+            return
+
+        template = _make_slots(plan, entities)
+        # A due date the model derived from an entity (e.g. "Friday" -> "2024-05-10")
+        # can't be re-derived locally, so such plans are not reusable as templates.
+        if _has_derived_due(template):
+            return
+
+        key = pattern + context_fingerprint(context)
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+
+
+def _map_strings(value: Any, fn: Callable[[str], str]) -> Any:
+    """Applies fn to every string inside a (nested) plan dict."""
+    if isinstance(value, str):
+        return fn(value)
+    if isinstance(value, dict):
+        return {k: _map_strings(v, fn) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_map_strings(v, fn) for v in value]
+    return value
+
+
+def _has_derived_due(template: PlanDict) -> bool:
+    """True if a slotted plan has a due value that isn't one of the input's entities."""
+    return any(
+        task.get("due") and not _SLOT_RE.search(task["due"])
+        for task in template.get("tasks", [])
+    )
+
+
+def _make_slots(plan: PlanDict, entities: List[str]) -> PlanDict:
+    # Longest first, so "10" is not carved out of "10:30" before the time is matched.
+    ordered = sorted(enumerate(entities, start=1), key=lambda item: -len(item[1]))
+    patterns = [
+        (re.compile(rf"(?<!\w){re.escape(entity)}(?!\w)", re.IGNORECASE), f"<ENTITY{idx}>")
+        for idx, entity in ordered
+    ]
+
+    def _slot(text: str) -> str:
+        for regex, slot in patterns:
+            text = regex.sub(slot, text)
+        return text
+
+    return _map_strings(plan, _slot)
+
+
+def _fill_slots(template: PlanDict, entities: List[str]) -> PlanDict:
+    return _map_strings(template, lambda text: _SLOT_RE.sub(lambda m: entities[int(m.group(1)) - 1], text))
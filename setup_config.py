@@ -1,13 +1,25 @@
+"""
+setup_config.py - Vertex AI authentication for the Colab notebook
+The Colab/GCP SDKs are imported inside initialize_environment, so importing this module
+is cheap, and repeat calls in a session reuse the first successful initialization.
+"""
 import os
 import json
-from google.colab import userdata
-from google.oauth2 import service_account
-from google.cloud import aiplatform as vertexai 
+import functools
+from typing import Literal
+
+AuthMode = Literal["secret", "adc"]
+
+@functools.lru_cache(maxsize=None)
+def _init_vertex(project_id: str, mode: AuthMode):
+    """Runs vertexai.init once per (project_id, mode). Failures raise and are not cached."""
+    from google.cloud import aiplatform as vertexai
+
+    credentials = None
+    if mode == "secret":
+        from google.colab import userdata
+        from google.oauth2 import service_account
 
-def initialize_environment(project_id: str):
-    print("--- 🚀 Starting Cloud-Native Authentication ---")
-    
-    try:
         # 1. Get the JSON string from Colab Secrets
         key_json = userdata.get('GCP_CREDENTIALS')
         
@@ -16,20 +28,34 @@ def initialize_environment(project_id: str):
         
         # 3. Create Credentials object directly from info
         credentials = service_account.Credentials.from_service_account_info(key_info)
+
+    # 4. Initialize Vertex AI (credentials=None falls back to Application Default Credentials)
+    os.environ["GCP_PROJECT_ID"] = project_id
+    vertexai.init(
+        project=project_id,
+        location="us-central1",
+        credentials=credentials
+    )
+    return credentials
+
+def initialize_environment(project_id: str, mode: AuthMode = "secret"):
+    """Authenticates Vertex AI from Colab Secrets (mode="secret") or ADC (mode="adc")."""
+    from google.cloud import aiplatform as vertexai
+
+    print("--- 🚀 Starting Cloud-Native Authentication ---")
+    
+    try:
+        credentials = _init_vertex(project_id, mode)
         
-        # 4. Initialize Vertex AI
-        os.environ["GCP_PROJECT_ID"] = project_id
-        vertexai.init(
-            project=project_id,
-            location="us-central1",
-            credentials=credentials
-        )
-        
-        print("✅ Success! Authenticated using Colab Secrets.")
-        print(f"Service Account: {credentials.service_account_email}")
+        if credentials is not None:
+            print("✅ Success! Authenticated using Colab Secrets.")
+            print(f"Service Account: {credentials.service_account_email}")
+        else:
+            print("✅ Success! Authenticated using Application Default Credentials.")
         
     except Exception as e:
         print(f"❌ Auth Failed: {e}")
-        print("Did you add 'GCP_CREDENTIALS' to the Secrets (🔑) tab on the left?")
+        if mode == "secret":
+            print("Did you add 'GCP_CREDENTIALS' to the Secrets (🔑) tab on the left?")
         
     return None, os, vertexai
@@ -2,60 +2,291 @@
 tools.py - Persistent Tools for ADHD Assistant
 Now with real file I/O to simulate database/API persistence.
 """
+import asyncio
+import atexit
 import json
 import os
+import sys
 import datetime
-from typing import Any, Dict, List
+import functools
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import fast_json
 
 # --- Configuration ---
 USER_PROFILE_FILE = "user_profile.json"
-CALENDAR_DB_FILE = "calendar_db.json"
+# Append-only JSON Lines log, one event per line. Older versions kept a single JSON
+# array in LEGACY_CALENDAR_DB_FILE; it is imported on first use (see _compact).
+CALENDAR_DB_FILE = "calendar_db.jsonl"
+LEGACY_CALENDAR_DB_FILE = "calendar_db.json"
+
+# Tools may run concurrently (see execute_tool_async); serialize calendar writes so
+# parallel writers don't interleave lines or race on event ids.
+_CALENDAR_LOCK = threading.Lock()
+_event_total: Optional[int] = None  # events in the log plus the write buffer
+# Content key (title, due, priority) -> id of every scheduled event with an absolute
+# (ISO) due date, so a repeated event (user re-asks, agent retries) returns the existing
+# id instead of being written again. Relative dues ("tonight", "Friday", reminders'
+# "1 hour from now") mean a different time on each day, so those records are never
+# deduplicated. Seeded from the log on first use.
+_SEEN_EVENTS: Optional[Dict[Tuple[Any, ...], str]] = None
+
+# Write-back buffer: appended events sit here until FLUSH_EVERY have queued up or
+# FLUSH_INTERVAL seconds have passed, then go to disk in one write. Call force_flush()
+# before reading the log; it also runs at interpreter exit.
+FLUSH_EVERY = 32
+FLUSH_INTERVAL = 30.0
+_PENDING: List[bytes] = []
+_flush_timer: Optional[threading.Timer] = None
+
+# Parsed files keyed by path and stamped with the file's (mtime, size), so an unchanged
+# file is never re-read. Built user contexts are memoized the same way (_build_context).
+_JSON_CACHE: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+
+# The context string the LLM sees; filled from a flat view of the profile.
+_CONTEXT_TEMPLATE = (
+    "User Name: {name}. "
+    "Focus Time: {focus_time}. "
+    "Style: {communication_style}. "
+    "Current Goals: {goals}."
+)
+_CONTEXT_DEFAULTS = {"name": "Unknown", "focus_time": "Unknown", "communication_style": "Standard"}
+# Context for a user with no profile file; precomputed so a known-missing profile costs
+# nothing but the stat that finds it missing.
+_MISSING_CONTEXT = _CONTEXT_TEMPLATE.format_map({**_CONTEXT_DEFAULTS, "goals": ""})
 
 # --- Helper Functions ---
+def _file_stamp(filepath: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
 def _load_json(filepath: str) -> Any:
     """Helper to safely load JSON data."""
-    if not os.path.exists(filepath):
-        return {} if filepath == USER_PROFILE_FILE else []
+    cached = _JSON_CACHE.get(filepath)
+    if cached is not None and _file_stamp(filepath) == cached[0]:
+        return cached[1]
+    # EAFP: open directly (a missing file is one failed open, not stat + open) and take
+    # the stamp from the open handle, so it describes exactly the bytes we parsed.
     try:
-        with open(filepath, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
+        with open(filepath, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = fast_json.load_file(f, st.st_size)
+    except (FileNotFoundError, json.JSONDecodeError):  # orjson.JSONDecodeError subclasses the latter
         return {} if filepath == USER_PROFILE_FILE else []
+    _JSON_CACHE[filepath] = ((st.st_mtime_ns, st.st_size), data)
+    return data
 
 def _save_json(filepath: str, data: Any):
     """Helper to safely save JSON data."""
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(filepath, 'wb') as f:
+        f.write(fast_json.dumps_bytes(data, indent=True))
+    _JSON_CACHE.pop(filepath, None)
+    if filepath == USER_PROFILE_FILE:
+        invalidate_user_context()
 
-# --- Tool Implementations ---
+def _compact() -> List[Dict[str, Any]]:
+    """Puts the event log in canonical form before the first write of this process.
 
-def get_user_context(user_id: str) -> Dict[str, Any]:
+    Imports the legacy JSON array file if there is no log yet, and drops blank or torn
+    lines (e.g. from a crash mid-append). A log whose last record lacks its newline is
+    rewritten too, or the next append would be glued onto that line. The log is only
+    rewritten if something changed. Returns the events in the log.
     """
-    Retrieves user profile and preferences from local storage.
-    Simulates a RAG retrieval or Database lookup.
+    if os.path.exists(CALENDAR_DB_FILE):
+        with open(CALENDAR_DB_FILE, 'rb') as f:
+            data = f.read()
+        lines = data.splitlines()
+        events = []
+        for line in lines:
+            try:
+                events.append(fast_json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        if len(events) == len(lines) and (not data or data.endswith(b"\n")):
+            return events
+    elif os.path.exists(LEGACY_CALENDAR_DB_FILE):
+        events = _load_json(LEGACY_CALENDAR_DB_FILE)
+    else:
+        return []
+
+    tmp_path = CALENDAR_DB_FILE + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.writelines(fast_json.dumps_line(event) for event in events)
+    os.replace(tmp_path, CALENDAR_DB_FILE)
+    return events
+
+def _open_log() -> None:
+    """Compacts the log and seeds the event count and content index from that single
+    read. Runs on first use only; _append_event keeps both in step afterwards. Caller
+    holds _CALENDAR_LOCK.
     """
-    print(f"🧠 [MEMORY] Reading profile for: {user_id}")
-    
-    data = _load_json(USER_PROFILE_FILE)
+    global _event_total, _SEEN_EVENTS
+    events = _compact()
+    seen: Dict[Tuple[Any, ...], str] = {}
+    for record in events:
+        _index_event(seen, record)
+    _event_total = len(events)
+    _SEEN_EVENTS = seen
+
+def _event_count() -> int:
+    """Number of events in the log plus the write buffer. Caller holds _CALENDAR_LOCK."""
+    if _event_total is None:
+        _open_log()
+    return _event_total
+
+def _event_key(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    return record.get("title"), record.get("due"), record.get("priority")
+
+def _is_absolute_due(due: Any) -> bool:
+    """True for an ISO date or datetime, which names the same moment on every day."""
+    try:
+        datetime.datetime.fromisoformat(due)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def _index_event(seen: Dict[Tuple[Any, ...], str], record: Dict[str, Any]) -> None:
+    if record.get("type") != "notification" and _is_absolute_due(record.get("due")):
+        seen.setdefault(_event_key(record), record.get("id"))
+
+def _seen_events() -> Dict[Tuple[Any, ...], str]:
+    """Content-key index of the log and the write buffer. Caller holds _CALENDAR_LOCK."""
+    if _SEEN_EVENTS is None:
+        _open_log()
+    return _SEEN_EVENTS
+
+def _next_event_id(prefix: str) -> str:
+    return f"{prefix}_{_event_count() + 1}"
+
+def _append_event(record: Dict[str, Any]) -> int:
+    """Queues one event for the log and returns the new total. Caller holds _CALENDAR_LOCK."""
+    global _event_total, _flush_timer
+    count = _event_count()
+    _PENDING.append(fast_json.dumps_line(record))
+    _event_total = count + 1
+    _index_event(_seen_events(), record)
+    if len(_PENDING) >= FLUSH_EVERY:
+        _flush_locked()
+    elif _flush_timer is None:
+        _flush_timer = threading.Timer(FLUSH_INTERVAL, force_flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+    return _event_total
+
+def _flush_locked() -> None:
+    """Writes the buffer with one append: O(events) bytes, not O(file). Caller holds _CALENDAR_LOCK."""
+    global _flush_timer
+    if _flush_timer is not None:
+        _flush_timer.cancel()
+        _flush_timer = None
+    if not _PENDING:
+        return
+    with open(CALENDAR_DB_FILE, 'ab') as f:
+        f.write(b"".join(_PENDING))
+        # One fsync per batch makes a flushed batch durable, like a WAL commit.
+        f.flush()
+        os.fsync(f.fileno())
+    _PENDING.clear()
+
+def force_flush() -> None:
+    """Writes any buffered calendar events to disk now."""
+    with _CALENDAR_LOCK:
+        _flush_locked()
+
+async def force_flush_async() -> None:
+    """force_flush() on a worker thread, so the event loop isn't blocked on disk."""
+    await asyncio.to_thread(force_flush)
+
+atexit.register(force_flush)
+
+def _compact_profile(data: Any) -> Any:
+    """Compact copy of a profile for caching.
+
+    Dict keys are interned (every cached profile shares them), and a numerically
+    weighted `interests` mapping becomes one "topic:weight,..." string, heaviest
+    first. Interests with any non-numeric weight (e.g. "high") are left as they are.
+    """
+    if isinstance(data, dict):
+        compact = {sys.intern(key): _compact_profile(value) for key, value in data.items()}
+        interests = compact.get("interests")
+        if isinstance(interests, dict) and all(
+            isinstance(weight, (int, float)) and not isinstance(weight, bool)
+            for weight in interests.values()
+        ):
+            ranked = sorted(interests.items(), key=lambda kv: -kv[1])
+            compact["interests"] = ",".join(f"{topic}:{weight}" for topic, weight in ranked)
+        return compact
+    if isinstance(data, list):
+        return [_compact_profile(item) for item in data]
+    return data
+
+@functools.lru_cache(maxsize=1)
+def _iso_second(second: int) -> str:
+    return datetime.datetime.fromtimestamp(second).isoformat()
+
+def _now_iso() -> str:
+    """Local time in isoformat with microseconds; the date/time part is formatted once per second."""
+    second, nanos = divmod(time.time_ns(), 1_000_000_000)
+    return f"{_iso_second(second)}.{nanos // 1000:06d}"
+
+def invalidate_user_context(user_id: Optional[str] = None) -> None:
+    """Drops cached user contexts; call after editing a profile.
+
+    Contexts are memoized with lru_cache, which can only be cleared as a whole, so
+    `user_id` is accepted for callers' clarity but every user's entry is dropped.
+    """
+    _build_context.cache_clear()
+    _JSON_CACHE.pop(USER_PROFILE_FILE, None)
+
+@functools.lru_cache(maxsize=128)
+def _build_context(user_id: str, profile_stamp: Optional[Tuple[int, int]]) -> Tuple[str, Dict[str, Any]]:
+    """Loads a user's (compacted) profile and formats its context string.
+
+    Memoized per (user_id, profile file stamp). Returns (context string, profile).
+    """
+    if profile_stamp is None:
+        return _MISSING_CONTEXT, {}
+
+    data = _compact_profile(_load_json(USER_PROFILE_FILE))
     
     # In a real app, we would filter by user_id. 
     # For this prototype, we assume the file belongs to the single active user.
     
     # Format it as a string for the LLM to read easily
-    prefs = data.get("preferences", {})
-    context_str = (
-        f"User Name: {data.get('name', 'Unknown')}. "
-        f"Focus Time: {prefs.get('focus_time', 'Unknown')}. "
-        f"Style: {prefs.get('communication_style', 'Standard')}. "
-        f"Current Goals: {', '.join(data.get('goals', []))}."
-    )
+    context_str = _CONTEXT_TEMPLATE.format_map({
+        **_CONTEXT_DEFAULTS,
+        **data,
+        **data.get("preferences", {}),
+        "goals": ", ".join(data.get("goals", ())),
+    })
+    if isinstance(data.get("interests"), str):
+        context_str += f" Interests: {data['interests']}."
+    
+    return context_str, data
+
+# --- Tool Implementations ---
+
+def get_user_context(user_id: str, include_raw: bool = False) -> Dict[str, Any]:
+    """
+    Retrieves user profile and preferences from local storage.
+    Simulates a RAG retrieval or Database lookup.
+    Only the formatted preferences are returned unless include_raw is set.
+    """
+    print(f"🧠 [MEMORY] Reading profile for: {user_id}")
+
+    context_str, data = _build_context(user_id, _file_stamp(USER_PROFILE_FILE))
+    context = {"user_preferences": context_str}
+    if include_raw:
+        context["raw_profile"] = data # useful for debugging
     
     return {
         "status": "success",
-        "context": {
-            "user_preferences": context_str,
-            "raw_profile": data # useful for debugging
-        }
+        "context": context
     }
 
 def schedule_event(task_description: str, due_date: str, priority: str = "normal") -> Dict[str, Any]:
@@ -64,24 +295,32 @@ def schedule_event(task_description: str, due_date: str, priority: str = "normal
     """
     print(f"📅 [CALENDAR] Scheduling '{task_description}'...")
     
-    events = _load_json(CALENDAR_DB_FILE)
-    
-    new_event = {
-        "id": f"evt_{len(events) + 1}",
-        "title": task_description,
-        "due": due_date,
-        "priority": priority,
-        "status": "scheduled",
-        "created_at": datetime.datetime.now().isoformat()
-    }
-    
-    events.append(new_event)
-    _save_json(CALENDAR_DB_FILE, events)
+    with _CALENDAR_LOCK:
+        event_id = None
+        if _is_absolute_due(due_date):
+            event_id = _seen_events().get((task_description, due_date, priority))
+        if event_id is not None:
+            return {
+                "status": "success",
+                "event_id": event_id,
+                "details": f"'{task_description}' is already scheduled for {due_date}."
+            }
+
+        new_event = {
+            "id": _next_event_id("evt"),
+            "title": task_description,
+            "due": due_date,
+            "priority": priority,
+            "status": "scheduled",
+            "created_at": _now_iso()
+        }
+        
+        total_events = _append_event(new_event)
     
     return {
         "status": "success",
         "event_id": new_event["id"],
-        "details": f"Scheduled '{task_description}' for {due_date}. Total events: {len(events)}"
+        "details": f"Scheduled '{task_description}' for {due_date}. Total events: {total_events}"
     }
 
 def set_reminder(task_description: str, remind_at: str) -> Dict[str, Any]:
@@ -90,18 +329,16 @@ def set_reminder(task_description: str, remind_at: str) -> Dict[str, Any]:
     """
     print(f"⏰ [REMINDER] Setting reminder for '{task_description}'...")
     
-    events = _load_json(CALENDAR_DB_FILE)
-    
-    new_reminder = {
-        "id": f"rem_{len(events) + 1}",
-        "title": f"REMINDER: {task_description}",
-        "due": remind_at,
-        "type": "notification",
-        "created_at": datetime.datetime.now().isoformat()
-    }
-    
-    events.append(new_reminder)
-    _save_json(CALENDAR_DB_FILE, events)
+    with _CALENDAR_LOCK:
+        new_reminder = {
+            "id": _next_event_id("rem"),
+            "title": f"REMINDER: {task_description}",
+            "due": remind_at,
+            "type": "notification",
+            "created_at": _now_iso()
+        }
+        
+        _append_event(new_reminder)
 
     return {
         "status": "success",
@@ -119,4 +356,12 @@ TOOL_REGISTRY = {
 def execute_tool(tool_name: str, payload: Dict[str, Any]) -> Any:
     if tool_name not in TOOL_REGISTRY:
         return {"status": "error", "message": f"Unknown tool: {tool_name}"}
-    return TOOL_REGISTRY[tool_name](**payload)
\ No newline at end of file
+    return TOOL_REGISTRY[tool_name](**payload)
+
+async def execute_tool_async(tool_name: str, payload: Dict[str, Any]) -> Any:
+    """Runs a tool in a worker thread so several tool calls can overlap their I/O."""
+    return await asyncio.to_thread(execute_tool, tool_name, payload)
+
+async def execute_tools(batch: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+    """Runs several tool calls concurrently; results come back in batch order."""
+    return await asyncio.gather(*(execute_tool_async(tool_name, payload) for tool_name, payload in batch))